@@ -23,20 +23,20 @@ st.set_page_config(
 # -----------------------------
 # Theme: background image + visible text
 # -----------------------------
-_bgm_b64 = ""
 _bgm_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bgm.jpeg")
-if os.path.isfile(_bgm_path):
-    with open(_bgm_path, "rb") as _f:
-        _bgm_b64 = base64.b64encode(_f.read()).decode("utf-8")
-
-_logo_b64 = ""
 _logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "VISTA_logo.png")
-if os.path.isfile(_logo_path):
-    with open(_logo_path, "rb") as _f:
-        _logo_b64 = base64.b64encode(_f.read()).decode("utf-8")
 
-st.markdown(
-    """
+
+@st.cache_data
+def _file_b64(path: str) -> str:
+    """Base64-encode a static asset once instead of on every rerun ("" if missing)."""
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+_CSS = """
 <style>
 /* ---------- Light theme: background image at 50% above cream, below content ---------- */
 .stApp {
@@ -571,15 +571,25 @@ div[data-testid="stForm"] [data-testid="column"]:first-of-type {
 .stFileUploader > div { border: none !important; }
 [data-baseweb="slider"] { border: none !important; border-radius: 12px; }
 </style>
-""".replace("__BGM_B64__", _bgm_b64),
-    unsafe_allow_html=True,
-)
+"""
+
+
+@st.cache_data
+def _inject_css() -> str:
+    """Theme CSS with the background image inlined, built once and reused across reruns."""
+    return _CSS.replace("__BGM_B64__", _file_b64(_bgm_path))
+
+
+st.markdown(_inject_css(), unsafe_allow_html=True)
 
 # -----------------------------
 # Session state
 # -----------------------------
-if "video_bytes" not in st.session_state:
-    st.session_state.video_bytes = None
+# video_file: the UploadedFile from the uploader, or the path of the default video
+if "video_file" not in st.session_state:
+    st.session_state.video_file = None
+if "video_file_id" not in st.session_state:
+    st.session_state.video_file_id = None
 if "video_name" not in st.session_state:
     st.session_state.video_name = None
 if "play_from" not in st.session_state:
@@ -590,6 +600,12 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "last_jump" not in st.session_state:
     st.session_state.last_jump = None
+if "chat_bubbles" not in st.session_state:
+    st.session_state.chat_bubbles = []  # rendered HTML, one entry per message
+
+
+# Most recent messages kept in the live chat panel; older ones go in an expander
+_CHAT_WINDOW = 40
 
 
 def _msg_to_html(text: str) -> str:
@@ -601,18 +617,44 @@ def _msg_to_html(text: str) -> str:
     return s.replace("\n", "<br>")
 
 
-def get_video_duration(video_bytes: bytes) -> float:
-    """Get video duration in seconds using OpenCV."""
+def _bubble_html(msg: dict) -> str:
+    """Render one chat message as a bubble row."""
+    role = msg.get("role", "assistant")
+    text = msg.get("text", "")
+    ts = msg.get("timestamp_s", None)
+    content = _msg_to_html(text)
+    meta = f"<div class='chat-meta'>Jump to {float(ts):.1f}s</div>" if ts is not None else ""
+    row_class = "user" if role == "user" else ""
+    return (
+        f"<div class='chat-row {row_class}'>"
+        f"<div class='chat-bubble'><p>{content}</p>{meta}</div>"
+        f"</div>"
+    )
+
+
+def _chat_panel_html(bubbles: list[str]) -> str:
+    """Wrap pre-rendered bubble rows in the chat panel markup."""
+    return "\n".join(["<div class='chat-panel'>", "<div class='chat-messages'>", *bubbles, "</div></div>"])
+
+
+def get_video_duration(video) -> float:
+    """Get video duration in seconds using OpenCV (accepts a file path or an uploaded file)."""
     try:
         import cv2
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
-            f.write(video_bytes)
-            path = f.name
+        tmp_path = None
+        if isinstance(video, str):
+            path = video
+        else:
+            # OpenCV needs a real file; write the upload's buffer without copying it
+            with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+                f.write(video.getbuffer())
+                path = tmp_path = f.name
         cap = cv2.VideoCapture(path)
         fps = cap.get(cv2.CAP_PROP_FPS) or 30
         frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
         cap.release()
-        os.unlink(path)
+        if tmp_path:
+            os.unlink(tmp_path)
         if frames and frames > 0:
             return frames / fps
     except Exception:
@@ -626,11 +668,10 @@ def seek_to(timestamp_s: float, duration: float) -> float:
 
 # Default video: load check.mp4 from project dir if no video set yet
 _default_video_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "check.mp4")
-if st.session_state.video_bytes is None and os.path.isfile(_default_video_path):
-    with open(_default_video_path, "rb") as _f:
-        st.session_state.video_bytes = _f.read()
+if st.session_state.video_file is None and os.path.isfile(_default_video_path):
+    st.session_state.video_file = _default_video_path
     st.session_state.video_name = "check.mp4"
-    st.session_state.video_duration = get_video_duration(st.session_state.video_bytes)
+    st.session_state.video_duration = get_video_duration(_default_video_path)
 
 
 def _video_player_html(video_base64: str, mime: str, start_time: float) -> str:
@@ -906,11 +947,16 @@ class ModelResult:
     timestamp_s: Optional[float] = None
 
 
+# Timestamp patterns, compiled once at import: "12.5s" and "[h:]mm:ss"
+_TS_SEC = re.compile(r"(\d+(?:\.\d+)?)\s*s\b")
+_TS_HMS = re.compile(r"\b(?:(\d+):)?(\d{1,2}):(\d{2})\b")
+
+
 def _parse_timestamp_hint(text: str) -> Optional[float]:
-    m = re.search(r"(\d+(?:\.\d+)?)\s*s\b", text.lower())
+    m = _TS_SEC.search(text.lower())
     if m:
         return float(m.group(1))
-    m = re.search(r"\b(?:(\d+):)?(\d{1,2}):(\d{2})\b", text)
+    m = _TS_HMS.search(text)
     if m:
         hh = int(m.group(1)) if m.group(1) else 0
         mm = int(m.group(2))
@@ -919,8 +965,10 @@ def _parse_timestamp_hint(text: str) -> Optional[float]:
     return None
 
 
-def answer_question(video_bytes: bytes | None, question: str) -> ModelResult:
-    if not video_bytes:
+def answer_question(video, question: str) -> ModelResult:
+    # video is an UploadedFile or a file path; read its bytes (video.getvalue())
+    # only inside the real model call, never up front.
+    if video is None:
         return ModelResult("Upload a video first, then ask questions about it.", None)
     ts = _parse_timestamp_hint(question)
     if ts is not None:
@@ -934,31 +982,33 @@ def answer_question(video_bytes: bytes | None, question: str) -> ModelResult:
 # -----------------------------
 # Header (navigation bar: logo left, title + subtitle)
 # -----------------------------
-_logo_img = ""
-if _logo_b64:
-    _logo_img = f'<img src="data:image/png;base64,{_logo_b64}" alt="VISTA" class="nav-bar-logo" />'
-st.markdown(
-    f"""
+@st.cache_data
+def _header_html() -> str:
+    """Static nav-bar markup (logo inlined), built once and reused across reruns."""
+    logo_b64 = _file_b64(_logo_path)
+    logo_img = ""
+    if logo_b64:
+        logo_img = f'<img src="data:image/png;base64,{logo_b64}" alt="VISTA" class="nav-bar-logo" />'
+    return f"""
     <div class="nav-bar-vibe">
       <div class="nav-bar-left">
-        {_logo_img}
+        {logo_img}
         <span class="nav-bar-title">VISTA</span>
       </div>
       <span class="nav-bar-subtitle"><strong>V</strong>ideo <strong>I</strong>ntelligence with <strong>S</strong>patio-<strong>T</strong>emporal <strong>A</strong>ugmented Retrieval for Egocentric Understanding</span>
     </div>
-    """,
-    unsafe_allow_html=True,
-)
+    """
+
+
+st.markdown(_header_html(), unsafe_allow_html=True)
 
-# -----------------------------
-# Layout
-# -----------------------------
-left, right = st.columns([1.05, 0.95], gap="large")
 
 # -----------------------------
 # Left: Video
 # -----------------------------
-with left:
+@st.fragment
+def video_panel() -> None:
+    """Uploader and player; a fragment, so its widgets rerun only this panel."""
     uploaded = st.file_uploader(
         "Upload video",
         type=["mp4", "mov", "m4v", "webm"],
@@ -987,14 +1037,16 @@ with left:
         """,
         unsafe_allow_html=True,
     )
-    if uploaded is not None:
-        st.session_state.video_bytes = uploaded.getvalue()
+    # Keep the UploadedFile itself; only (re)process when a different file arrives
+    if uploaded is not None and uploaded.file_id != st.session_state.video_file_id:
+        st.session_state.video_file = uploaded
+        st.session_state.video_file_id = uploaded.file_id
         st.session_state.video_name = uploaded.name
         st.session_state.play_from = 0.0
         st.session_state.last_jump = None
-        st.session_state.video_duration = get_video_duration(st.session_state.video_bytes)
+        st.session_state.video_duration = get_video_duration(uploaded)
 
-    if not st.session_state.video_bytes:
+    if st.session_state.video_file is None:
         st.markdown(
             "<p style='color:#c8c8d4; font-size:14px; font-weight:500; line-height:1.5;'>Get started.</p>",
             unsafe_allow_html=True,
@@ -1004,42 +1056,29 @@ with left:
         ext = name.rsplit(".", 1)[-1].lower() if "." in name else "mp4"
         mime_map = {"mp4": "video/mp4", "mov": "video/quicktime", "webm": "video/webm", "m4v": "video/x-m4v"}
         mime = mime_map.get(ext, "video/mp4")
-        # Default video: serve from file path so /media/ 404 is avoided
-        _check_mp4_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "check.mp4")
-        if name == "check.mp4" and os.path.isfile(_check_mp4_path):
-            st.video(_check_mp4_path, format="video/mp4")
-        else:
-            try:
-                suffix = "." + ext if ext in ("mp4", "mov", "webm", "m4v") else ".mp4"
-                with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-                    tmp.write(st.session_state.video_bytes)
-                    tmp_path = tmp.name
-                st.video(tmp_path, format=mime)
-            except Exception:
-                st.video(st.session_state.video_bytes, format=mime)
+        # Default video is a file path (avoids /media/ 404); uploads are passed
+        # as the UploadedFile so Streamlit serves them without an extra copy
+        st.video(st.session_state.video_file, format=mime)
+
 
 # -----------------------------
 # Right: Chat
 # -----------------------------
-with right:
-    chat_html = [
-        "<div class='chat-panel'>",
-        "<div class='chat-messages'>",
-    ]
-    for msg in st.session_state.messages:
-        role = msg.get("role", "assistant")
-        text = msg.get("text", "")
-        ts = msg.get("timestamp_s", None)
-        content = _msg_to_html(text)
-        meta = f"<div class='chat-meta'>Jump to {float(ts):.1f}s</div>" if ts is not None else ""
-        row_class = "user" if role == "user" else ""
-        chat_html.append(
-            f"<div class='chat-row {row_class}'>"
-            f"<div class='chat-bubble'><p>{content}</p>{meta}</div>"
-            f"</div>"
-        )
-    chat_html.append("</div></div>")
-    st.markdown("\n".join(chat_html), unsafe_allow_html=True)
+@st.fragment
+def chat_panel() -> None:
+    """Chat history and input; a fragment, so sending a message reruns only this panel."""
+    messages = st.session_state.messages
+    bubbles = st.session_state.chat_bubbles
+    if len(bubbles) > len(messages):
+        bubbles.clear()  # history was reset; rebuild from scratch
+    # Only messages appended since the last rerun are converted to HTML
+    bubbles.extend(_bubble_html(msg) for msg in messages[len(bubbles):])
+
+    older, recent = bubbles[:-_CHAT_WINDOW], bubbles[-_CHAT_WINDOW:]
+    if older:
+        with st.expander(f"Earlier messages ({len(older)})"):
+            st.markdown(_chat_panel_html(older), unsafe_allow_html=True)
+    st.markdown(_chat_panel_html(recent), unsafe_allow_html=True)
 
     # Chat input: transparent field + send button with upward arrow
     with st.form("chat_form", clear_on_submit=True):
@@ -1073,16 +1112,26 @@ with right:
 
         with st.spinner("Thinking…"):
             time.sleep(0.2)
-            res = answer_question(st.session_state.video_bytes, user_q)
+            res = answer_question(st.session_state.video_file, user_q)
 
         if res.timestamp_s is not None:
-            st.session_state.play_from = seek_to(res.timestamp_s, st.session_state.video_duration if st.session_state.video_bytes else 900)
+            st.session_state.play_from = seek_to(res.timestamp_s, st.session_state.video_duration if st.session_state.video_file is not None else 900)
             st.session_state.last_jump = st.session_state.play_from
 
         st.session_state.messages.append(
             {"role": "assistant", "text": res.answer, "timestamp_s": res.timestamp_s}
         )
-        st.rerun()
+        st.rerun(scope="fragment")
+
+
+# -----------------------------
+# Layout
+# -----------------------------
+left, right = st.columns([1.05, 0.95], gap="large")
+with left:
+    video_panel()
+with right:
+    chat_panel()
 
 # -----------------------------
 # Footer
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Build the precomputed OSHA hazard statistics table.
+
+Runs the category match once for every known hazard category and stores the
+results in hazard_category_stats, so the risk scorer can read them by key
+instead of querying incidents on every request. The indexer runs this
+automatically; use this script to refresh an existing database.
+
+Usage:
+    python scripts/build_stats.py
+    python scripts/build_stats.py --db vesta/utils/osha_incidents.db
+"""
+
+import argparse
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from vesta.utils.osha_analysis.risk_scorer import (
+    build_hazard_category_stats,
+    get_project_root,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute per-category OSHA hazard statistics"
+    )
+    parser.add_argument("--db", default=str(get_project_root() / "osha_incidents.db"),
+                        help="Path to osha_incidents.db built by the indexer")
+    args = parser.parse_args()
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        print("Please run the indexer first to create the database.")
+        sys.exit(1)
+
+    conn = sqlite3.connect(str(db_path))
+    try:
+        count = build_hazard_category_stats(conn)
+    finally:
+        conn.close()
+    print(f"Stored statistics for {count} hazard categories in {db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Unit tests for the OSHA analysis utilities — no OSHA data download needed.
+
+Tests CSV encoding detection and the FTS5/LIKE query builders against a
+small fixture database built in a temporary directory.
+"""
+
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from vesta.utils.osha_analysis import indexer, rag_retriever, risk_scorer, stats
+from vesta.utils.osha_analysis.indexer import detect_encoding
+from vesta.utils.osha_analysis.rag_retriever import build_fts_query, build_like_pattern
+
+
+_TMP_DIR = tempfile.TemporaryDirectory()
+
+
+def _write_bytes(data: bytes, name: str = "sample.csv") -> Path:
+    path = Path(_TMP_DIR.name) / name
+    path.write_bytes(data)
+    return path
+
+
+# Fixture incidents: every combination of these OIICS-style titles and
+# narratives, so each category filter matches a known, overlapping subset
+_EVENTS = [
+    "Fall to lower level",
+    "Fall on same level",
+    "Slip without fall",
+    "Tripped over object",
+    "Struck by object",
+    "Struck against object or equipment",
+    "Caught in running equipment",
+    "Compressed or pinched by shifting objects",
+    "Contact with electric current",
+    "Exposure to caustic",
+    "Fire in building",
+    "Explosion of pressure vessel",
+    "Burn from hot object",
+]
+_SOURCES = [
+    "Roofs",
+    "Power lines",
+    "Forklift",
+    "Electric wiring",
+    "Ladders",
+    "Chemical products",
+    "Scaffolds",
+    "Toxic gas",
+]
+_NARRATIVES = [
+    "Employee was electrocuted by an exposed wire",
+    "Worker received an electric shock from a panel",
+    "Worker fell through an unguarded floor-hole",
+    "Guardrail was 100% missing at the edge, tagged no_guard",
+    "Pallet of 1000 lbs shifted onto the worker",
+    "Rail carried a noxguard label",
+]
+
+
+def _build_fixture_db() -> Path:
+    """Build (once) a small indexed incidents database and return its path."""
+    db_path = Path(_TMP_DIR.name) / "osha_incidents.db"
+    if db_path.exists():
+        return db_path
+
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    indexer.create_incidents_table(conn)
+    rows = []
+    for event in _EVENTS:
+        for source in _SOURCES:
+            for narrative in _NARRATIVES:
+                i = len(rows) + 1
+                outcome = 1 if i % 7 == 0 else 2
+                rows.append((
+                    i, "Acme Builders", "Springfield", "IL", "236220", "Construction",
+                    2020 + i % 4, "2021-01-01", outcome, i % 45, 0, 1, "Laborer",
+                    narrative, None, None, None, None, None,
+                    "Fracture", "Leg", event, source, None,
+                ))
+    conn.executemany(indexer.INSERT_SQL, rows)
+    indexer.create_fts_table(conn)
+    indexer.rebuild_fts_index(conn)
+    conn.close()
+    return db_path
+
+
+# The LIKE filters the category lookups used before moving to FTS5
+_RISK_LIKE_FILTERS = {
+    "Fall Hazard": "event_title_pred LIKE '%fall%'",
+    "Electrical Hazard": """(event_title_pred LIKE '%contact with electric%'
+        OR event_title_pred LIKE '%contact with wiring%'
+        OR source_title_pred LIKE '%electric%'
+        OR source_title_pred LIKE '%wiring%'
+        OR source_title_pred LIKE '%power line%'
+        OR nar_what_happened LIKE '%electrocuted%'
+        OR nar_what_happened LIKE '%electric shock%')""",
+    "Struck By": "event_title_pred LIKE '%struck%'",
+    "Caught In": "(event_title_pred LIKE '%caught%' OR event_title_pred LIKE '%compress%')",
+    "Chemical Hazard": "(event_title_pred LIKE '%expos%' AND (source_title_pred LIKE '%chemical%' OR source_title_pred LIKE '%toxic%'))",
+    "Slip/Trip": "(event_title_pred LIKE '%fall on same level%' OR event_title_pred LIKE '%slip%' OR event_title_pred LIKE '%trip%')",
+    "Fire Hazard": "(event_title_pred LIKE '%fire%' OR event_title_pred LIKE '%explosion%' OR event_title_pred LIKE '%burn%')",
+    "Pressure Vessel": "event_title_pred LIKE '%Pressure Vessel%'",
+    "Forklift": "event_title_pred LIKE '%Forklift%'",
+}
+
+_STATS_LIKE_FILTERS = {
+    "Fall Hazard": _RISK_LIKE_FILTERS["Fall Hazard"],
+    "Electrical Hazard": _RISK_LIKE_FILTERS["Electrical Hazard"],
+    "Struck By": _RISK_LIKE_FILTERS["Struck By"],
+    "Caught In/Between": _RISK_LIKE_FILTERS["Caught In"],
+    "Slip/Trip": "(event_title_pred LIKE '%fall on same level%' OR event_title_pred LIKE '%slip%')",
+    "Fire/Explosion": "(event_title_pred LIKE '%fire%' OR event_title_pred LIKE '%explosion%')",
+}
+
+
+def _like_hazard_stats(conn: sqlite3.Connection, like_filter: str):
+    """(frequency, fatal, avg dafw, severe) the way the LIKE queries computed them."""
+    return conn.execute(f"""
+        SELECT COUNT(*),
+               COALESCE(SUM(incident_outcome = 1), 0),
+               COALESCE(AVG(CASE WHEN dafw_num_away > 0 THEN dafw_num_away END), 0.0),
+               COALESCE(SUM(dafw_num_away >= 30), 0)
+        FROM incidents WHERE {like_filter}
+    """).fetchone()
+
+
+def test_detect_encoding_utf8():
+    path = _write_bytes("id,name\n1,Café\n".encode("utf-8"))
+    assert detect_encoding(path) == "utf-8"
+
+    path = _write_bytes(b"\xef\xbb\xbf" + "id,name\n1,Café\n".encode("utf-8"))
+    assert detect_encoding(path) == "utf-8-sig"
+    print("  ✓ detect_encoding_utf8")
+
+
+def test_detect_encoding_late_non_ascii():
+    # 80 KB of ASCII rows before the first cp1252 byte
+    ascii_rows = b"".join(b"%d,plain ascii row\n" % i for i in range(5000))
+    assert len(ascii_rows) > 80000
+    path = _write_bytes(b"id,name\n" + ascii_rows + "1,Café\n".encode("cp1252"))
+
+    encoding = detect_encoding(path)
+    assert encoding == "cp1252"
+    with open(path, encoding=encoding) as f:
+        assert f.read().endswith("1,Café\n")
+
+    # Also when the bad byte lands beyond the first chunk
+    assert detect_encoding(path, chunk_size=1024) == "cp1252"
+    print("  ✓ detect_encoding_late_non_ascii")
+
+
+def test_detect_encoding_utf8_split_across_chunks():
+    # A multi-byte character straddling a chunk boundary is still UTF-8
+    data = b"a" * 1023 + "é\n".encode("utf-8")
+    path = _write_bytes(data)
+    assert detect_encoding(path, chunk_size=1024) == "utf-8"
+    print("  ✓ detect_encoding_utf8_split_across_chunks")
+
+
+def test_detect_encoding_bom_with_invalid_bytes():
+    # A BOM is kept even when a cp1252 byte follows, so the header stays
+    # clean and the bad byte is replaced rather than aborting the load
+    path = _write_bytes(b"\xef\xbb\xbf" + b"id,name\n1,Caf\xe9\n")
+    encoding = detect_encoding(path)
+    assert encoding == "utf-8-sig"
+    with open(path, encoding=encoding, errors="replace") as f:
+        assert f.read() == "id,name\n1,Caf\ufffd\n"
+    print("  ✓ detect_encoding_bom_with_invalid_bytes")
+
+
+def test_build_like_pattern_escapes_wildcards():
+    assert build_like_pattern("100%") == "%100\\%%"
+    assert build_like_pattern("no_guard") == "%no\\_guard%"
+    assert build_like_pattern("a\\b") == "%a\\\\b%"
+
+    conn = sqlite3.connect(str(_build_fixture_db()))
+    query = "SELECT DISTINCT nar_what_happened FROM incidents WHERE nar_what_happened LIKE ? ESCAPE '\\'"
+    # '%' and '_' match literally, not as wildcards ('1000 lbs', 'noxguard')
+    for label in ("100%", "no_guard"):
+        matches = [row[0] for row in conn.execute(query, (build_like_pattern(label),))]
+        assert matches == ["Guardrail was 100% missing at the edge, tagged no_guard"], matches
+    conn.close()
+    print("  ✓ build_like_pattern_escapes_wildcards")
+
+
+def test_build_fts_query_quotes_terms():
+    assert build_fts_query("Floor Hole") == '"floor"* OR "hole"*'
+    assert build_fts_query("floor-hole") == '"floor-hole"*'
+    assert build_fts_query('say "no"') == '"say"* OR """no"""*'
+
+    # Punctuation would be FTS5 syntax errors unquoted; quoted, each label
+    # is a valid MATCH expression
+    conn = sqlite3.connect(str(_build_fixture_db()))
+    query = "SELECT DISTINCT nar_what_happened FROM incidents_fts WHERE incidents_fts MATCH ?"
+    for label in ("floor-hole", "100%", "no_guard", "(ladder)", "a:b", "OR", 'say "no"'):
+        conn.execute(query, (build_fts_query(label),)).fetchall()
+    matches = [row[0] for row in conn.execute(query, (build_fts_query("floor-hole"),))]
+    assert matches == ["Worker fell through an unguarded floor-hole"], matches
+    conn.close()
+    print("  ✓ build_fts_query_quotes_terms")
+
+
+def test_retrieve_narratives_punctuation_labels():
+    db_path = _build_fixture_db()
+    original_get_db_path = rag_retriever.get_db_path
+    rag_retriever.get_db_path = lambda: db_path
+    try:
+        for label, expected in (("floor-hole", "floor-hole"), ("100%", "100"), ("no_guard", "guard")):
+            results = rag_retriever.retrieve_narratives(label, k=5)
+            assert len(results) == 5, label
+            assert all(expected in r["what_happened"] for r in results), (label, results)
+        assert rag_retriever.retrieve_narratives("   ") == []
+    finally:
+        rag_retriever.get_db_path = original_get_db_path
+    print("  ✓ retrieve_narratives_punctuation_labels")
+
+
+def test_risk_scorer_filters_match_like():
+    conn = sqlite3.connect(str(_build_fixture_db()))
+    cursor = conn.cursor()
+    fts_filters = {category: risk_scorer.get_category_filter(category) for category in _RISK_LIKE_FILTERS}
+    live = risk_scorer.query_hazard_stats(cursor, list(fts_filters.values()))
+    for category, like_filter in _RISK_LIKE_FILTERS.items():
+        expected = _like_hazard_stats(conn, like_filter)
+        actual = live[fts_filters[category]]
+        assert actual[0] == expected[0] and actual[1] == expected[1] and actual[3] == expected[3], (category, actual, expected)
+        assert abs(actual[2] - expected[2]) < 1e-9, category
+    assert live[fts_filters["Fall Hazard"]][0] > 0
+    assert live[fts_filters["Forklift"]][0] == 0
+
+    # The precomputed table holds the same numbers for the known categories
+    risk_scorer.build_hazard_category_stats(conn)
+    precomputed = risk_scorer.query_precomputed_stats(cursor, list(risk_scorer.CATEGORY_FILTERS))
+    for category, like_filter in _RISK_LIKE_FILTERS.items():
+        key = risk_scorer.get_category_key(category)
+        if key is not None:
+            assert precomputed[key] == live[fts_filters[category]], category
+    conn.close()
+    print("  ✓ risk_scorer_filters_match_like")
+
+
+def test_stats_filters_match_like():
+    conn = sqlite3.connect(str(_build_fixture_db()))
+    assert set(stats.STATS_CATEGORIES) == set(_STATS_LIKE_FILTERS)
+    all_stats = {
+        category: stats.compute_category_stats(conn.cursor(), category, stats.get_category_filter(category))
+        for category in stats.STATS_CATEGORIES
+    }
+    for category, like_filter in _STATS_LIKE_FILTERS.items():
+        total, fatal, dafw_count, max_dafw = conn.execute(f"""
+            SELECT COUNT(*), SUM(incident_outcome = 1), SUM(incident_outcome = 2), MAX(dafw_num_away)
+            FROM incidents WHERE {like_filter}
+        """).fetchone()
+        years = {
+            str(year): n for year, n in conn.execute(f"""
+                SELECT year_filing_for, COUNT(*) FROM incidents WHERE {like_filter}
+                GROUP BY year_filing_for
+            """)
+        }
+        category_stats = all_stats[category]
+        assert total > 0, category
+        assert category_stats["total_count"] == total, category
+        assert category_stats["fatal_count"] == fatal, category
+        assert category_stats["dafw_count"] == dafw_count, category
+        assert category_stats["max_dafw"] == max_dafw, category
+        assert category_stats["year_breakdown"] == years, category
+        for top in category_stats["top_sources"]:
+            n = conn.execute(
+                f"SELECT COUNT(*) FROM incidents WHERE {like_filter} AND source_title_pred = ?",
+                (top["source"],)
+            ).fetchone()[0]
+            assert top["count"] == n, (category, top)
+    conn.close()
+    print("  ✓ stats_filters_match_like")
+
+
+def test_get_all_stats_returns_a_copy():
+    db_path = _build_fixture_db()
+    original_get_cache_path = stats.get_cache_path
+    stats.get_cache_path = lambda: Path(_TMP_DIR.name) / "osha_stats_cache.pkl"
+    try:
+        first = stats.get_all_stats(str(db_path))
+        first["Fall Hazard"]["total_count"] = -1
+        first["Fall Hazard"]["top_sources"].clear()
+        second = stats.get_all_stats(str(db_path))
+        assert second["Fall Hazard"]["total_count"] > 0
+        assert second["Fall Hazard"]["top_sources"]
+    finally:
+        stats.get_cache_path = original_get_cache_path
+    print("  ✓ get_all_stats_returns_a_copy")
+
+
+if __name__ == "__main__":
+    print("\n  VESTA OSHA Analysis Tests")
+    print("  " + "-" * 40)
+    test_detect_encoding_utf8()
+    test_detect_encoding_late_non_ascii()
+    test_detect_encoding_utf8_split_across_chunks()
+    test_detect_encoding_bom_with_invalid_bytes()
+    test_build_like_pattern_escapes_wildcards()
+    test_build_fts_query_quotes_terms()
+    test_retrieve_narratives_punctuation_labels()
+    test_risk_scorer_filters_match_like()
+    test_stats_filters_match_like()
+    test_get_all_stats_returns_a_copy()
+    print("\n  All tests passed! ✓\n")
@@ -0,0 +1,87 @@
+"""
+Shared SQLite helpers for the OSHA query modules.
+
+The retriever and risk scorer share one tuned connection per database
+path instead of each opening their own. The stats module opens a separate
+connection for its one-off cache build, but shares the quoting for
+free-text FTS5 terms.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+
+# db_path -> (file identity when opened, connection)
+_CONNECTIONS: Dict[str, Tuple[Optional[Tuple[int, int]], sqlite3.Connection]] = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+
+def _file_identity(db_path: str) -> Optional[Tuple[int, int]]:
+    """Return (inode, mtime in ns) for the database file, or None if missing."""
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _open_conn(db_path: str) -> sqlite3.Connection:
+    """Open a connection tuned for the read-mostly query workload."""
+    conn = sqlite3.connect(
+        db_path, check_same_thread=False, isolation_level=None, cached_statements=256
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory-mapped reads
+    return conn
+
+
+def get_conn(db_path: str) -> sqlite3.Connection:
+    """
+    Get a process-wide cached connection to the OSHA database.
+    
+    Reusing one connection per database path skips the connect handshake on
+    every query and keeps SQLite's page and statement caches warm. The
+    connection is in autocommit mode and tuned once for the read-mostly
+    query workload; all query SQL is parameterized so the enlarged
+    statement cache can reuse prepared statements.
+    
+    The cached connection is keyed on the file's inode and modification
+    time, so when the indexer deletes and recreates the database a running
+    app reopens it on the next call instead of reading the deleted file.
+    Connections still cached are closed at exit.
+    """
+    identity = _file_identity(db_path)
+    with _CONNECTIONS_LOCK:
+        cached = _CONNECTIONS.get(db_path)
+        if cached is not None:
+            cached_identity, conn = cached
+            if cached_identity == identity:
+                return conn
+            # Other threads may still be mid-query on the stale connection,
+            # so it is only dropped from the cache; it closes when the last
+            # reference goes away
+        conn = _open_conn(db_path)
+        # Opening in WAL mode can touch the file, so record it afterwards
+        _CONNECTIONS[db_path] = (_file_identity(db_path), conn)
+        return conn
+
+
+@atexit.register
+def _close_all() -> None:
+    """Close every cached connection."""
+    with _CONNECTIONS_LOCK:
+        for _, conn in _CONNECTIONS.values():
+            conn.close()
+        _CONNECTIONS.clear()
+
+
+def fts_phrase(text: str) -> str:
+    """Quote free text as an FTS5 prefix phrase (e.g. '"power line" *')."""
+    return '"' + text.replace('"', '""') + '" *'
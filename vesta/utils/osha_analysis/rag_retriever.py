@@ -6,9 +6,18 @@ Searches SQLite database with FTS5 to find real OSHA incidents matching
 a given hazard label, returning narratives for use in hazard warnings.
 """
 
+import functools
 import sqlite3
+import sys
 from pathlib import Path
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Tuple
+
+# Allow running this file directly as a script (python .../rag_retriever.py):
+# make the repository root importable for the absolute vesta imports
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from vesta.utils.osha_analysis._db import get_conn
 
 
 def get_project_root() -> Path:
@@ -21,76 +30,117 @@ def get_db_path() -> Path:
     return get_project_root() / 'osha_incidents.db'
 
 
+_FATAL = "FATAL"
+_OTHER = "Other recordable case"
+_UNKNOWN = "Unknown"
+
+
+def _outcome_fatal(dafw_num_away: int, djtr_num_tr: int) -> str:
+    return _FATAL
+
+
+def _outcome_days_away(dafw_num_away: int, djtr_num_tr: int) -> str:
+    return f"{dafw_num_away} days away from work" if dafw_num_away > 0 else "Days away from work"
+
+
+def _outcome_job_transfer(dafw_num_away: int, djtr_num_tr: int) -> str:
+    return f"{djtr_num_tr} days job transfer/restriction" if djtr_num_tr > 0 else "Job transfer/restriction"
+
+
+def _outcome_other(dafw_num_away: int, djtr_num_tr: int) -> str:
+    return _OTHER
+
+
+def _outcome_unknown(dafw_num_away: int, djtr_num_tr: int) -> str:
+    return _UNKNOWN
+
+
+_OUTCOME_FORMATTERS = {
+    1: _outcome_fatal,
+    2: _outcome_days_away,
+    3: _outcome_job_transfer,
+    4: _outcome_other,
+}
+
+
 def format_outcome(incident_outcome: Optional[int], dafw_num_away: int, djtr_num_tr: int) -> str:
     """Convert incident_outcome integer to human-readable string."""
-    if incident_outcome == 1:
-        return "FATAL"
-    elif incident_outcome == 2:
-        if dafw_num_away > 0:
-            return f"{dafw_num_away} days away from work"
-        else:
-            return "Days away from work"
-    elif incident_outcome == 3:
-        if djtr_num_tr > 0:
-            return f"{djtr_num_tr} days job transfer/restriction"
-        else:
-            return "Job transfer/restriction"
-    elif incident_outcome == 4:
-        return "Other recordable case"
-    else:
-        return "Unknown"
-
-
-def get_category_expansion(category: Optional[str]) -> List[str]:
-    """Get additional search terms based on hazard category."""
-    if category is None:
-        return []
-    
+    return _OUTCOME_FORMATTERS.get(incident_outcome, _outcome_unknown)(dafw_num_away, djtr_num_tr)
+
+
+# Search expansion per normalized category: (column, FTS5 prefix term) pairs,
+# combined into a single MATCH expression so the expansion is answered from
+# the incidents_fts index
+CATEGORY_EXPANSIONS: Dict[str, List[Tuple[str, str]]] = {
+    "fall": [
+        ("event_title_pred", "fall*"),
+        ("source_title_pred", "ladder*"),
+        ("source_title_pred", "scaffold*"),
+        ("source_title_pred", "roof*")
+    ],
+    "electric": [
+        ("event_title_pred", '"contact with electric" *'),
+        ("event_title_pred", '"contact with wiring" *'),
+        ("source_title_pred", "electric*"),
+        ("source_title_pred", "wiring*"),
+        ("source_title_pred", '"power line" *'),
+        ("nar_what_happened", "electrocuted*"),
+        ("nar_what_happened", '"electric shock" *')
+    ],
+    "struck": [
+        ("event_title_pred", "struck*"),
+        ("event_title_pred", "hit*")
+    ],
+    "caught": [
+        ("event_title_pred", "caught*"),
+        ("event_title_pred", "compress*")
+    ],
+    "chemical": [
+        ("event_title_pred", "expos*"),
+        ("source_title_pred", "chemical*")
+    ],
+    "slip": [
+        ("event_title_pred", "slip*"),
+        ("event_title_pred", "trip*"),
+        ("event_title_pred", '"same level" *')
+    ],
+}
+
+# Keywords that select each expansion, checked in order (first match wins)
+_CATEGORY_KEYWORDS = (
+    ("fall", ("fall",)),
+    ("electric", ("electric",)),
+    ("struck", ("struck", "hit")),
+    ("caught", ("caught", "compress")),
+    ("chemical", ("chemical",)),
+    ("slip", ("slip", "trip")),
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _normalize_category(category: str) -> Optional[str]:
+    """Map a free-text category to its CATEGORY_EXPANSIONS key, or None."""
     category = category.lower()
-    expansions = []
-    
-    if "fall" in category:
-        expansions.extend([
-            "event_title_pred LIKE '%fall%'",
-            "source_title_pred LIKE '%ladder%'",
-            "source_title_pred LIKE '%scaffold%'",
-            "source_title_pred LIKE '%roof%'"
-        ])
-    elif "electric" in category:
-        expansions.extend([
-            "event_title_pred LIKE '%contact with electric%'",
-            "event_title_pred LIKE '%contact with wiring%'",
-            "source_title_pred LIKE '%electric%'",
-            "source_title_pred LIKE '%wiring%'",
-            "source_title_pred LIKE '%power line%'",
-            "nar_what_happened LIKE '%electrocuted%'",
-            "nar_what_happened LIKE '%electric shock%'"
-        ])
-    elif "struck" in category or "hit" in category:
-        expansions.extend([
-            "event_title_pred LIKE '%struck%'",
-            "event_title_pred LIKE '%hit%'"
-        ])
-    elif "caught" in category or "compress" in category:
-        expansions.extend([
-            "event_title_pred LIKE '%caught%'",
-            "event_title_pred LIKE '%compress%'"
-        ])
-    elif "chemical" in category:
-        expansions.extend([
-            "event_title_pred LIKE '%expos%'",
-            "source_title_pred LIKE '%chemical%'"
-        ])
-    elif "slip" in category or "trip" in category:
-        expansions.extend([
-            "event_title_pred LIKE '%slip%'",
-            "event_title_pred LIKE '%trip%'",
-            "event_title_pred LIKE '%same level%'"
-        ])
+    for key, keywords in _CATEGORY_KEYWORDS:
+        if any(keyword in category for keyword in keywords):
+            return key
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def get_category_expansion(category: Optional[str]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Get additional search terms based on hazard category.
+    Returns (column, FTS5 prefix term) pairs from CATEGORY_EXPANSIONS, as a
+    tuple since the result is cached and shared between calls.
+    """
+    if category is None:
+        return ()
     
-    return expansions
+    return tuple(CATEGORY_EXPANSIONS.get(_normalize_category(category), ()))
 
 
+@functools.lru_cache(maxsize=256)
 def build_fts_query(hazard_label: str) -> str:
     """
     Build FTS5 query string from hazard label.
@@ -98,11 +148,122 @@ def build_fts_query(hazard_label: str) -> str:
     """
     # Clean and split the hazard label into search terms
     terms = hazard_label.lower().strip().split()
-    # Join with OR to match any term, and use * for prefix matching
-    query_terms = [f"{term}*" for term in terms if term]
+    # Quote each term so punctuation can't break the FTS5 syntax, join with
+    # OR to match any term, and use * for prefix matching
+    query_terms = ['"' + term.replace('"', '""') + '"*' for term in terms if term]
     return " OR ".join(query_terms) if query_terms else hazard_label
 
 
+def build_like_pattern(text: str) -> str:
+    """
+    Build a LIKE '%text%' pattern with %, _ and \\ escaped.
+    Use with LIKE ? ESCAPE '\\' so user text is always matched literally.
+    """
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+# bm25 column weights, in incidents_fts column order: nar_what_happened,
+# nar_before_incident, nar_injury_illness, nar_object_substance,
+# incident_description, event_title_pred, source_title_pred
+NARRATIVE_RANK = "bm25(10.0, 2.0, 2.0, 2.0, 2.0, 5.0, 1.0)"
+
+# Step 1: FTS5 search across narrative fields - rank is weighted bm25
+# relevance (lower/more negative = more relevant)
+NARRATIVE_FTS_CTE = f"""
+    narrative AS (
+        SELECT rowid AS id FROM incidents_fts
+        WHERE incidents_fts MATCH ? AND rank MATCH '{NARRATIVE_RANK}'
+        ORDER BY rank
+        LIMIT ?
+    )"""
+
+# Step 1 fallback when the FTS5 query fails: LIKE over the narrative fields
+NARRATIVE_LIKE_CTE = """
+    narrative AS (
+        SELECT id FROM incidents
+        WHERE nar_what_happened LIKE ? ESCAPE '\\' OR
+              nar_before_incident LIKE ? ESCAPE '\\' OR
+              incident_location LIKE ? ESCAPE '\\' OR
+              nar_injury_illness LIKE ? ESCAPE '\\' OR
+              nar_object_substance LIKE ? ESCAPE '\\' OR
+              incident_description LIKE ? ESCAPE '\\'
+        LIMIT ?
+    )"""
+
+# Step 3: Category-based expansion (only when the category has one)
+EXPANSION_CTE = """,
+    expansion AS (
+        SELECT rowid AS id FROM incidents_fts
+        WHERE incidents_fts MATCH ?
+        LIMIT ?
+    )"""
+
+# Force the ranked CTE to be computed once up front where the SQLite build
+# supports the hint (3.35+); older versions materialize it anyway because
+# of its LIMIT
+MATERIALIZED = "MATERIALIZED" if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+
+# Steps 2 and 4: LIKE on event_title_pred/source_title_pred, then union all
+# candidates and pick the top k, fatals first, then dafw_num_away DESC. Only
+# the k winners are joined back for their text columns, which are selected
+# in the order retrieve_narratives unpacks them and aliased to the result
+# dict keys. relevance_score is a simple heuristic: base 0.5, +0.3 fatal,
+# +0.1 for 30+ days away (+0.05 for any), +0.1 narrative match, +0.05 OSHA
+# classification match, capped at 1.0.
+CANDIDATE_QUERY_TEMPLATE = """
+    WITH {narrative_cte},
+    titles AS (
+        SELECT id FROM incidents
+        WHERE event_title_pred LIKE ? ESCAPE '\\' OR source_title_pred LIKE ? ESCAPE '\\'
+        LIMIT ?
+    ){expansion_cte},
+    candidates AS (
+        SELECT id, 1 AS src FROM narrative
+        UNION ALL SELECT id, 2 FROM titles
+        {expansion_union}
+    ),
+    ranked AS {materialized} (
+        SELECT 
+            i.id AS id,
+            CASE WHEN i.incident_outcome = 1 THEN 0 ELSE 1 END AS fatal_rank,
+            i.dafw_num_away AS dafw_num_away,
+            MAX(c.src = 1) AS in_narrative,
+            MAX(c.src = 2) AS in_titles
+        FROM candidates c
+        JOIN incidents i ON i.id = c.id
+        GROUP BY i.id
+        ORDER BY fatal_rank, i.dafw_num_away DESC
+        LIMIT ?
+    )
+    SELECT 
+        COALESCE(i.nar_what_happened, '') AS what_happened,
+        COALESCE(i.nar_injury_illness, '') AS injury_description,
+        COALESCE(i.nar_object_substance, '') AS object_involved,
+        COALESCE(i.incident_location, '') AS location,
+        i.incident_outcome AS incident_outcome,
+        COALESCE(i.dafw_num_away, 0) AS dafw_days,
+        COALESCE(i.djtr_num_tr, 0) AS djtr_num_tr,
+        COALESCE(i.event_title_pred, '') AS event_type,
+        COALESCE(i.source_title_pred, '') AS source,
+        COALESCE(i.nature_title_pred, '') AS nature_of_injury,
+        COALESCE(i.part_title_pred, '') AS body_part,
+        i.year_filing_for AS year,
+        MIN(1.0,
+            0.5
+            + CASE WHEN i.incident_outcome = 1 THEN 0.3 ELSE 0 END
+            + CASE WHEN i.dafw_num_away > 30 THEN 0.1
+                   WHEN i.dafw_num_away > 0 THEN 0.05
+                   ELSE 0 END
+            + CASE WHEN r.in_narrative THEN 0.1 ELSE 0 END
+            + CASE WHEN r.in_titles THEN 0.05 ELSE 0 END
+        ) AS relevance_score
+    FROM ranked r
+    JOIN incidents i ON i.id = r.id
+    ORDER BY r.fatal_rank, r.dafw_num_away DESC
+"""
+
+
 def retrieve_narratives(
     hazard_label: str,
     category: Optional[str] = None,
@@ -123,137 +284,74 @@ def retrieve_narratives(
     if not db_path.exists():
         raise FileNotFoundError(f"Database not found: {db_path}")
     
-    conn = sqlite3.connect(str(db_path))
-    conn.row_factory = sqlite3.Row
+    # A blank label would become MATCH '' (syntax error) and then LIKE '%%',
+    # matching every incident; there is nothing to retrieve
+    if not hazard_label.strip():
+        return []
+    
+    conn = get_conn(str(db_path))
     cursor = conn.cursor()
     
-    # Step 1: FTS5 search across narrative fields
+    # Candidate sources, each capped at k * 3 rows, are combined and joined
+    # to incidents in one statement (see CANDIDATE_QUERY_TEMPLATE)
     fts_query = build_fts_query(hazard_label)
-    fts_rowids: Set[int] = set()
+    search_pattern = build_like_pattern(hazard_label)
+    expansions = get_category_expansion(category) if category else ()
+    expansion_query = " OR ".join(f"{column}: {term}" for column, term in expansions)
+    
+    params: List = [search_pattern, search_pattern, k * 3]
+    expansion_cte = ""
+    expansion_union = ""
+    if expansion_query:
+        params += [expansion_query, k * 3]
+        expansion_cte = EXPANSION_CTE
+        expansion_union = "UNION ALL SELECT id, 3 FROM expansion"
+    params.append(k)
     
     try:
-        # FTS5 search - rank is bm25 relevance (lower/more negative = more relevant)
-        cursor.execute("""
-            SELECT rowid, rank
-            FROM incidents_fts
-            WHERE incidents_fts MATCH ?
-            ORDER BY rank
-            LIMIT ?
-        """, (fts_query, k * 3))  # Get more candidates for deduplication
-        
-        for row in cursor.fetchall():
-            fts_rowids.add(row['rowid'])
+        cursor.execute(
+            CANDIDATE_QUERY_TEMPLATE.format(
+                narrative_cte=NARRATIVE_FTS_CTE,
+                expansion_cte=expansion_cte,
+                expansion_union=expansion_union,
+                materialized=MATERIALIZED,
+            ),
+            [fts_query, k * 3] + params
+        )
     except sqlite3.OperationalError as e:
         # If FTS5 query fails, try simpler approach
         print(f"Warning: FTS5 query failed: {e}")
-        # Fallback: search individual fields with LIKE
-        cursor.execute("""
-            SELECT id FROM incidents
-            WHERE nar_what_happened LIKE ? OR
-                  nar_before_incident LIKE ? OR
-                  incident_location LIKE ? OR
-                  nar_injury_illness LIKE ? OR
-                  nar_object_substance LIKE ? OR
-                  incident_description LIKE ?
-            LIMIT ?
-        """, (f"%{hazard_label}%",) * 6 + (k * 3,))
-        for row in cursor.fetchall():
-            fts_rowids.add(row['id'])
-    
-    # Step 2: Direct LIKE searches on event_title_pred and source_title_pred
-    like_rowids: Set[int] = set()
-    search_pattern = f"%{hazard_label}%"
-    
-    cursor.execute("""
-        SELECT id FROM incidents
-        WHERE event_title_pred LIKE ? OR source_title_pred LIKE ?
-        LIMIT ?
-    """, (search_pattern, search_pattern, k * 3))
-    
-    for row in cursor.fetchall():
-        like_rowids.add(row['id'])
-    
-    # Step 3: Category-based expansion
-    category_rowids: Set[int] = set()
-    if category:
-        expansions = get_category_expansion(category)
-        if expansions:
-            expansion_query = " OR ".join(expansions)
-            cursor.execute(f"""
-                SELECT id FROM incidents
-                WHERE {expansion_query}
-                LIMIT ?
-            """, (k * 3,))
-            for row in cursor.fetchall():
-                category_rowids.add(row['id'])
-    
-    # Combine all rowids and deduplicate
-    all_rowids = fts_rowids | like_rowids | category_rowids
-    
-    if not all_rowids:
-        conn.close()
-        return []
-    
-    # Step 4: Join to incidents table and get full data
-    # Sort by: fatals first, then by dafw_num_away DESC
-    placeholders = ','.join('?' * len(all_rowids))
-    cursor.execute(f"""
-        SELECT 
-            id, establishment_name, city, state, naics_code,
-            year_filing_for, date_of_incident, incident_outcome,
-            dafw_num_away, djtr_num_tr, type_of_incident, job_description,
-            nar_what_happened, nar_before_incident, incident_location,
-            nar_injury_illness, nar_object_substance, incident_description,
-            nature_title_pred, part_title_pred, event_title_pred,
-            source_title_pred, sec_source_title_pred
-        FROM incidents
-        WHERE id IN ({placeholders})
-        ORDER BY 
-            CASE WHEN incident_outcome = 1 THEN 0 ELSE 1 END,
-            dafw_num_away DESC
-        LIMIT ?
-    """, list(all_rowids) + [k])
+        # Fallback: search individual narrative fields with LIKE
+        cursor.execute(
+            CANDIDATE_QUERY_TEMPLATE.format(
+                narrative_cte=NARRATIVE_LIKE_CTE,
+                expansion_cte=expansion_cte,
+                expansion_union=expansion_union,
+                materialized=MATERIALIZED,
+            ),
+            [search_pattern] * 6 + [k * 3] + params
+        )
     
     results = []
-    for row in cursor.fetchall():
-        incident_outcome = row['incident_outcome']
-        dafw_num_away = row['dafw_num_away'] or 0
-        djtr_num_tr = row['djtr_num_tr'] or 0
-        
-        # Calculate relevance score (simple heuristic)
-        # Higher score for: fatals, high dafw, matches in key fields
-        relevance_score = 0.5  # Base score
-        if incident_outcome == 1:
-            relevance_score += 0.3  # Fatal cases are highly relevant
-        if dafw_num_away > 30:
-            relevance_score += 0.1  # Very severe injuries
-        elif dafw_num_away > 0:
-            relevance_score += 0.05  # Any days away
-        if row['id'] in fts_rowids:
-            relevance_score += 0.1  # Matched in narrative text
-        if row['id'] in like_rowids:
-            relevance_score += 0.05  # Matched in OSHA classifications
-        
-        relevance_score = min(1.0, relevance_score)  # Cap at 1.0
-        
-        result = {
-            'what_happened': row['nar_what_happened'] or '',
-            'injury_description': row['nar_injury_illness'] or '',
-            'object_involved': row['nar_object_substance'] or '',
-            'location': row['incident_location'] or '',
+    for (what_happened, injury_description, object_involved, location,
+         incident_outcome, dafw_num_away, djtr_num_tr, event_type, source,
+         nature_of_injury, body_part, year, relevance_score) in cursor.fetchall():
+        results.append({
+            'what_happened': what_happened,
+            'injury_description': injury_description,
+            'object_involved': object_involved,
+            'location': location,
             'outcome': format_outcome(incident_outcome, dafw_num_away, djtr_num_tr),
             'dafw_days': dafw_num_away,
-            'event_type': row['event_title_pred'] or '',
-            'source': row['source_title_pred'] or '',
-            'nature_of_injury': row['nature_title_pred'] or '',
-            'body_part': row['part_title_pred'] or '',
-            'year': row['year_filing_for'],
+            'event_type': event_type,
+            'source': source,
+            'nature_of_injury': nature_of_injury,
+            'body_part': body_part,
+            'year': year,
             'is_fatal': (incident_outcome == 1),
             'relevance_score': relevance_score
-        }
-        results.append(result)
+        })
     
-    conn.close()
     return results
 
 
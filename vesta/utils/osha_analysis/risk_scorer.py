@@ -13,46 +13,82 @@ Score Components:
 - Serious Case Rate (max 15 pts): Fraction with 30+ days away
 """
 
+import functools
+import operator
 import sqlite3
+import sys
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+# Allow running this file directly as a script (python .../risk_scorer.py):
+# make the repository root importable for the absolute vesta imports
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from vesta.utils.osha_analysis._db import fts_phrase, get_conn
+
 
 def get_project_root() -> Path:
     """Get the project root directory (utils folder)."""
     return Path(__file__).parent.parent
 
 
-def get_category_filter(category: str) -> str:
+# FTS5 MATCH expression for each known hazard category. These keys are also
+# the rows of the precomputed hazard_category_stats table.
+CATEGORY_FILTERS = {
+    "fall": "event_title_pred: fall*",
+    "electric": """event_title_pred: ("contact with electric" * OR "contact with wiring" *)
+            OR source_title_pred: (electric* OR wiring* OR "power line" *)
+            OR nar_what_happened: (electrocuted* OR "electric shock" *)""",
+    "struck": "event_title_pred: struck*",
+    "caught": "event_title_pred: (caught* OR compress*)",
+    "chemical": "event_title_pred: expos* AND source_title_pred: (chemical* OR toxic*)",
+    "slip": 'event_title_pred: ("fall on same level" * OR slip* OR trip*)',
+    "fire": "event_title_pred: (fire* OR explosion* OR burn*)",
+}
+
+
+# Keywords that select each CATEGORY_FILTERS key, checked in order
+# (first match wins)
+_CATEGORY_KEYWORDS = (
+    ("fall", ("fall",)),
+    ("electric", ("electric",)),
+    ("struck", ("struck",)),
+    ("caught", ("caught", "compress")),
+    ("chemical", ("chemical",)),
+    ("slip", ("slip", "trip")),
+    ("fire", ("fire",)),
+)
+
+
+@functools.lru_cache(maxsize=64)
+def get_category_key(category: str) -> Optional[str]:
     """
-    Convert hazard category to SQL WHERE clause filter.
-    Returns SQL condition for event_title_pred and source_title_pred matching.
+    Map a hazard category label to its CATEGORY_FILTERS key.
+    Returns None for categories without a predefined filter.
     """
     category_lower = category.lower()
+    for key, keywords in _CATEGORY_KEYWORDS:
+        if any(keyword in category_lower for keyword in keywords):
+            return key
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def get_category_filter(category: str) -> str:
+    """
+    Convert hazard category to an FTS5 MATCH expression.
+    Uses column filters on event_title_pred, source_title_pred and
+    nar_what_happened so the lookup goes through the incidents_fts index
+    instead of a LIKE scan. The result is bound as a MATCH parameter
+    by query_hazard_stats.
+    """
+    category_key = get_category_key(category)
+    if category_key is not None:
+        return CATEGORY_FILTERS[category_key]
     
-    if "fall" in category_lower:
-        return "event_title_pred LIKE '%fall%'"
-    elif "electric" in category_lower:
-        return """(event_title_pred LIKE '%contact with electric%'
-            OR event_title_pred LIKE '%contact with wiring%'
-            OR source_title_pred LIKE '%electric%'
-            OR source_title_pred LIKE '%wiring%'
-            OR source_title_pred LIKE '%power line%'
-            OR nar_what_happened LIKE '%electrocuted%'
-            OR nar_what_happened LIKE '%electric shock%')"""
-    elif "struck" in category_lower:
-        return "event_title_pred LIKE '%struck%'"
-    elif "caught" in category_lower or "compress" in category_lower:
-        return "(event_title_pred LIKE '%caught%' OR event_title_pred LIKE '%compress%')"
-    elif "chemical" in category_lower:
-        return "(event_title_pred LIKE '%expos%' AND (source_title_pred LIKE '%chemical%' OR source_title_pred LIKE '%toxic%'))"
-    elif "slip" in category_lower or "trip" in category_lower:
-        return "(event_title_pred LIKE '%fall on same level%' OR event_title_pred LIKE '%slip%' OR event_title_pred LIKE '%trip%')"
-    elif "fire" in category_lower:
-        return "(event_title_pred LIKE '%fire%' OR event_title_pred LIKE '%explosion%' OR event_title_pred LIKE '%burn%')"
-    else:
-        # Default: search in event_title_pred
-        return f"event_title_pred LIKE '%{category}%'"
+    # Default: search in event_title_pred
+    return f"event_title_pred: {fts_phrase(category)}"
 
 
 def get_grade(score: float) -> Tuple[str, str]:
@@ -86,36 +122,116 @@ def get_recommendation(score: float) -> str:
         return "Critical-risk site. Consider site shutdown until hazards are mitigated. Emergency safety protocols required."
 
 
-def query_frequency(cursor: sqlite3.Cursor, category_filter: str) -> int:
-    """Query 1: Count total incidents matching this hazard category."""
-    query = f"SELECT COUNT(*) FROM incidents WHERE {category_filter}"
-    cursor.execute(query)
-    result = cursor.fetchone()
-    return result[0] if result else 0
-
-
-def query_fatality_count(cursor: sqlite3.Cursor, category_filter: str) -> int:
-    """Query 2: Count fatal incidents for this hazard category."""
-    query = f"SELECT COUNT(*) FROM incidents WHERE {category_filter} AND incident_outcome = 1"
-    cursor.execute(query)
-    result = cursor.fetchone()
-    return result[0] if result else 0
+def query_hazard_stats(
+    cursor: sqlite3.Cursor,
+    category_filters: List[str]
+) -> Dict[str, Tuple[int, int, float, int]]:
+    """
+    Compute all four hazard metrics for every category in one statement.
+    
+    Each filter's FTS matches are tagged with the filter's position and
+    unioned, then joined to incidents once and grouped by tag. Overlapping
+    categories (e.g. falls and slips) each keep their full match set.
+    
+    Args:
+        cursor: Database cursor
+        category_filters: FTS5 MATCH expressions from get_category_filter
+        
+    Returns:
+        Dict mapping each filter to
+        (frequency_count, fatal_count, avg_dafw, severe_count)
+    """
+    unique_filters = list(dict.fromkeys(category_filters))
+    stats = {f: (0, 0, 0.0, 0) for f in unique_filters}
+    if not unique_filters:
+        return stats
+    
+    tagged = " UNION ALL ".join(
+        f"SELECT {i} AS hz, rowid AS id FROM incidents_fts WHERE incidents_fts MATCH ?"
+        for i in range(len(unique_filters))
+    )
+    query = f"""
+        WITH tagged AS ({tagged})
+        SELECT tagged.hz,
+               COUNT(*),
+               SUM(incidents.incident_outcome = 1),
+               AVG(CASE WHEN incidents.dafw_num_away > 0 THEN incidents.dafw_num_away END),
+               SUM(incidents.dafw_num_away >= 30)
+        FROM tagged
+        JOIN incidents ON incidents.id = tagged.id
+        GROUP BY tagged.hz
+    """
+    cursor.execute(query, unique_filters)
+    for hz, frequency_count, fatal_count, avg_dafw, severe_count in cursor.fetchall():
+        stats[unique_filters[hz]] = (
+            frequency_count, fatal_count or 0, avg_dafw or 0.0, severe_count or 0
+        )
+    return stats
 
 
-def query_avg_dafw(cursor: sqlite3.Cursor, category_filter: str) -> float:
-    """Query 3: Average dafw_num_away for incidents with dafw > 0."""
-    query = f"SELECT AVG(dafw_num_away) FROM incidents WHERE {category_filter} AND dafw_num_away > 0"
-    cursor.execute(query)
-    result = cursor.fetchone()
-    return result[0] if result and result[0] is not None else 0.0
+def build_hazard_category_stats(conn: sqlite3.Connection) -> int:
+    """
+    Precompute the four metrics for every CATEGORY_FILTERS key.
+    
+    Stores one row per category in hazard_category_stats so compute_site_risk
+    can read known categories by primary key instead of matching incidents.
+    Must be re-run whenever the incidents table is rebuilt.
+    
+    Args:
+        conn: Database connection
+        
+    Returns:
+        Number of categories stored
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS hazard_category_stats")
+    cursor.execute("""
+        CREATE TABLE hazard_category_stats (
+            category_key TEXT PRIMARY KEY,
+            freq INTEGER NOT NULL,
+            fatal INTEGER NOT NULL,
+            avg_dafw REAL NOT NULL,
+            severe INTEGER NOT NULL
+        )
+    """)
+    
+    stats = query_hazard_stats(cursor, list(CATEGORY_FILTERS.values()))
+    cursor.executemany(
+        "INSERT INTO hazard_category_stats VALUES (?, ?, ?, ?, ?)",
+        [(key, *stats[category_filter]) for key, category_filter in CATEGORY_FILTERS.items()]
+    )
+    conn.commit()
+    
+    # Refresh planner statistics now that the data is final
+    cursor.execute("ANALYZE")
+    cursor.execute("PRAGMA optimize")
+    
+    return len(CATEGORY_FILTERS)
 
 
-def query_severe_count(cursor: sqlite3.Cursor, category_filter: str) -> int:
-    """Query 4: Count incidents with 30+ days away from work."""
-    query = f"SELECT COUNT(*) FROM incidents WHERE {category_filter} AND dafw_num_away >= 30"
-    cursor.execute(query)
-    result = cursor.fetchone()
-    return result[0] if result else 0
+def query_precomputed_stats(
+    cursor: sqlite3.Cursor,
+    category_keys: List[str]
+) -> Dict[str, Tuple[int, int, float, int]]:
+    """
+    Look up precomputed metrics from hazard_category_stats.
+    
+    Returns an empty dict if the table has not been built, so callers can
+    fall back to query_hazard_stats.
+    """
+    if not category_keys:
+        return {}
+    
+    placeholders = ",".join("?" * len(category_keys))
+    try:
+        cursor.execute(
+            f"SELECT category_key, freq, fatal, avg_dafw, severe "
+            f"FROM hazard_category_stats WHERE category_key IN ({placeholders})",
+            category_keys
+        )
+    except sqlite3.OperationalError:
+        return {}
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
 
 
 def compute_hazard_score(
@@ -180,6 +296,9 @@ def compute_hazard_score(
     return final_score, score_components
 
 
+_score_key = operator.itemgetter('final_score')
+
+
 def compute_site_risk(
     hazard_registry: Dict[str, Dict[str, str]],
     db_path: Optional[str] = None
@@ -204,34 +323,69 @@ def compute_site_risk(
     if not Path(db_path).exists():
         raise FileNotFoundError(f"Database not found: {db_path}")
     
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
     breakdown = []
     hazard_scores = []
     
+    # Only hazards with a category need OSHA data; if there are none (or the
+    # registry is empty) the database is not touched at all
+    categories = {
+        hazard_id: hazard_data.get('category', '')
+        for hazard_id, hazard_data in hazard_registry.items()
+        if hazard_data.get('category', '').strip()
+    }
+    precomputed = {}
+    category_filters = {}
+    hazard_stats = {}
+    if categories:
+        conn = get_conn(db_path)
+        cursor = conn.cursor()
+        
+        # Known categories come from the precomputed table; anything else
+        # (or every category, if the table is missing) is matched live in one query
+        category_keys = {
+            hazard_id: get_category_key(category)
+            for hazard_id, category in categories.items()
+        }
+        precomputed = query_precomputed_stats(
+            cursor, [key for key in set(category_keys.values()) if key is not None]
+        )
+        category_filters = {
+            hazard_id: get_category_filter(category)
+            for hazard_id, category in categories.items()
+            if category_keys[hazard_id] not in precomputed
+        }
+        hazard_stats = query_hazard_stats(cursor, list(category_filters.values()))
+    
+    # Hazards sharing a category share their stats, so each distinct stats
+    # tuple is scored once: (final_score, score_components) by stats
+    scored: Dict[Tuple[int, int, float, int], Tuple[float, Dict[str, float]]] = {}
+    
     # Process each hazard in the registry
     for hazard_id, hazard_data in hazard_registry.items():
         label = hazard_data.get('label', '')
         category = hazard_data.get('category', '')
         
-        # Get category filter
-        category_filter = get_category_filter(category)
-        
-        # Run 4 queries against OSHA data
-        frequency_count = query_frequency(cursor, category_filter)
-        fatal_count = query_fatality_count(cursor, category_filter)
-        avg_dafw = query_avg_dafw(cursor, category_filter)
-        severe_count = query_severe_count(cursor, category_filter)
+        if hazard_id not in categories:
+            # No category to match against: zero breakdown
+            frequency_count, fatal_count, avg_dafw, severe_count = 0, 0, 0.0, 0
+        elif hazard_id in category_filters:
+            frequency_count, fatal_count, avg_dafw, severe_count = hazard_stats[
+                category_filters[hazard_id]
+            ]
+        else:
+            frequency_count, fatal_count, avg_dafw, severe_count = precomputed[
+                category_keys[hazard_id]
+            ]
         
         # Calculate rates
         fatality_rate = fatal_count / frequency_count if frequency_count > 0 else 0.0
         severe_rate = severe_count / frequency_count if frequency_count > 0 else 0.0
         
         # Compute score purely from OSHA data
-        final_score, score_components = compute_hazard_score(
-            frequency_count, fatal_count, avg_dafw, severe_count
-        )
+        stats = (frequency_count, fatal_count, avg_dafw, severe_count)
+        if stats not in scored:
+            scored[stats] = compute_hazard_score(*stats)
+        final_score, score_components = scored[stats]
         
         hazard_scores.append(final_score)
         
@@ -245,13 +399,11 @@ def compute_site_risk(
             'avg_dafw': round(avg_dafw, 1),
             'severe_rate': round(severe_rate, 3),
             'final_score': final_score,
-            'score_components': score_components
+            'score_components': dict(score_components)
         })
     
-    conn.close()
-    
     # Sort breakdown by risk score (highest first)
-    breakdown.sort(key=lambda x: x['final_score'], reverse=True)
+    breakdown.sort(key=_score_key, reverse=True)
     
     # Get top 5 hazards
     top_5_hazards = breakdown[:5]
@@ -263,7 +415,8 @@ def compute_site_risk(
         site_score = hazard_scores[0]
     else:
         # Worst hazard dominates: highest * 0.6 + mean(others) * 0.4
-        sorted_scores = sorted(hazard_scores, reverse=True)
+        # breakdown is already sorted by score, no need to sort again
+        sorted_scores = [entry['final_score'] for entry in breakdown]
         highest = sorted_scores[0]
         others = sorted_scores[1:]
         mean_others = sum(others) / len(others) if others else 0.0
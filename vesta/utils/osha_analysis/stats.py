@@ -6,152 +6,192 @@ Pre-computes headline statistics for VESTA hazard categories,
 providing instant citation-ready stats for UI display.
 """
 
+import argparse
+import copy
+import functools
 import sqlite3
+import sys
 import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+# Allow running this file directly as a script (python .../stats.py):
+# make the repository root importable for the absolute vesta imports
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from vesta.utils.osha_analysis._db import fts_phrase
+
+# Hazard categories the stats cache covers
+STATS_CATEGORIES = (
+    "Fall Hazard",
+    "Electrical Hazard",
+    "Struck By",
+    "Caught In/Between",
+    "Slip/Trip",
+    "Fire/Explosion",
+)
+
+
+# Paths are fixed relative to this file, so resolve them once at import
+_PROJECT_ROOT = Path(__file__).parent.parent
+_DB_PATH = _PROJECT_ROOT / 'osha_incidents.db'
+_CACHE_PATH = _PROJECT_ROOT / 'osha_stats_cache.pkl'
+
 
 def get_project_root() -> Path:
     """Get the project root directory (utils folder)."""
-    return Path(__file__).parent.parent
+    return _PROJECT_ROOT
 
 
 def get_db_path() -> Path:
     """Get the path to the SQLite database."""
-    return get_project_root() / 'osha_incidents.db'
+    return _DB_PATH
 
 
 def get_cache_path() -> Path:
-    """Get the path to the stats cache JSON file."""
-    return get_project_root() / 'osha_stats_cache.json'
+    """Get the path to the stats cache pickle file."""
+    return _CACHE_PATH
 
 
 def get_category_filter(category: str) -> str:
     """
-    Convert hazard category to SQL WHERE clause filter.
-    Returns SQL condition for event_title_pred matching.
+    Convert hazard category to an FTS5 MATCH expression.
+    Uses column filters on event_title_pred, source_title_pred and
+    nar_what_happened so the lookup goes through the incidents_fts index.
+    The result is bound as a MATCH parameter by compute_category_stats.
     """
     category_lower = category.lower()
     
     if "fall" in category_lower:
-        return "event_title_pred LIKE '%fall%'"
+        return "event_title_pred: fall*"
     elif "electric" in category_lower:
-        return """(event_title_pred LIKE '%contact with electric%'
-            OR event_title_pred LIKE '%contact with wiring%'
-            OR source_title_pred LIKE '%electric%'
-            OR source_title_pred LIKE '%wiring%'
-            OR source_title_pred LIKE '%power line%'
-            OR nar_what_happened LIKE '%electrocuted%'
-            OR nar_what_happened LIKE '%electric shock%')"""
+        return """event_title_pred: ("contact with electric" * OR "contact with wiring" *)
+            OR source_title_pred: (electric* OR wiring* OR "power line" *)
+            OR nar_what_happened: (electrocuted* OR "electric shock" *)"""
     elif "struck" in category_lower:
-        return "event_title_pred LIKE '%struck%'"
+        return "event_title_pred: struck*"
     elif "caught" in category_lower or "between" in category_lower:
-        return "(event_title_pred LIKE '%caught%' OR event_title_pred LIKE '%compress%')"
+        return "event_title_pred: (caught* OR compress*)"
     elif "slip" in category_lower or "trip" in category_lower:
-        return "(event_title_pred LIKE '%fall on same level%' OR event_title_pred LIKE '%slip%')"
+        return 'event_title_pred: ("fall on same level" * OR slip*)'
     elif "fire" in category_lower or "explosion" in category_lower:
-        return "(event_title_pred LIKE '%fire%' OR event_title_pred LIKE '%explosion%')"
+        return "event_title_pred: (fire* OR explosion*)"
     else:
         # Default: search in event_title_pred
-        return f"event_title_pred LIKE '%{category}%'"
+        return f"event_title_pred: {fts_phrase(category)}"
+
+
+def _empty_stats() -> Dict:
+    """Statistics for a category with no matching incidents."""
+    return {
+        'total_count': 0,
+        'fatal_count': 0,
+        'dafw_count': 0,
+        'avg_dafw': 0.0,
+        'max_dafw': 0,
+        'pct_fatal': 0.0,
+        'top_sources': [],
+        'top_body_parts': [],
+        'year_breakdown': {}
+    }
 
 
 def compute_category_stats(cursor: sqlite3.Cursor, category: str, category_filter: str) -> Dict:
     """
     Compute all statistics for a given hazard category.
     
+    Args:
+        cursor: Database cursor
+        category: Hazard category name
+        category_filter: FTS5 MATCH expression from get_category_filter
+        
     Returns:
         Dict with all computed statistics
     """
-    stats = {}
-    
-    # 1. Total count
-    cursor.execute(f"SELECT COUNT(*) FROM incidents WHERE {category_filter}")
-    stats['total_count'] = cursor.fetchone()[0]
-    
-    if stats['total_count'] == 0:
-        # Return empty stats if no incidents
-        return {
-            'total_count': 0,
-            'fatal_count': 0,
-            'dafw_count': 0,
-            'avg_dafw': 0.0,
-            'max_dafw': 0,
-            'pct_fatal': 0.0,
-            'top_sources': [],
-            'top_body_parts': [],
-            'year_breakdown': {}
-        }
-    
-    # 2. Fatal count
-    cursor.execute(f"""
-        SELECT COUNT(*) FROM incidents 
-        WHERE {category_filter} AND incident_outcome = 1
-    """)
-    stats['fatal_count'] = cursor.fetchone()[0]
-    
-    # 3. DAFW count (incident_outcome = 2)
-    cursor.execute(f"""
-        SELECT COUNT(*) FROM incidents 
-        WHERE {category_filter} AND incident_outcome = 2
-    """)
-    stats['dafw_count'] = cursor.fetchone()[0]
-    
-    # 4. Average dafw (only for incidents with dafw > 0)
-    cursor.execute(f"""
-        SELECT AVG(dafw_num_away) FROM incidents 
-        WHERE {category_filter} AND dafw_num_away > 0
-    """)
-    result = cursor.fetchone()[0]
-    stats['avg_dafw'] = round(result, 1) if result and result is not None else 0.0
+    stats = _empty_stats()
+    
+    # Incidents matching the category, looked up through the FTS index
+    matched = """
+        SELECT incidents.*
+        FROM incidents_fts
+        JOIN incidents ON incidents.id = incidents_fts.rowid
+        WHERE incidents_fts MATCH ?
+    """
+    params = (category_filter,)
     
-    # 5. Max dafw
+    # 1-5. Total, fatal, DAFW (incident_outcome = 2), average dafw (only for
+    # incidents with dafw > 0) and max dafw in a single aggregate pass
     cursor.execute(f"""
-        SELECT MAX(dafw_num_away) FROM incidents 
-        WHERE {category_filter}
-    """)
-    result = cursor.fetchone()[0]
-    stats['max_dafw'] = result if result is not None else 0
+        SELECT COUNT(*),
+               SUM(CASE WHEN incident_outcome = 1 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN incident_outcome = 2 THEN 1 ELSE 0 END),
+               AVG(CASE WHEN dafw_num_away > 0 THEN dafw_num_away END),
+               MAX(dafw_num_away)
+        FROM ({matched})
+    """, params)
+    total_count, fatal_count, dafw_count, avg_dafw, max_dafw = cursor.fetchone()
+    if not total_count:
+        return stats
+    
+    stats['total_count'] = total_count
+    stats['fatal_count'] = fatal_count
+    stats['dafw_count'] = dafw_count
+    stats['avg_dafw'] = round(avg_dafw, 1) if avg_dafw else 0.0
+    stats['max_dafw'] = max_dafw if max_dafw is not None else 0
     
     # 6. Percentage fatal
-    stats['pct_fatal'] = round((stats['fatal_count'] / stats['total_count']) * 100, 1) if stats['total_count'] > 0 else 0.0
+    stats['pct_fatal'] = round((fatal_count / total_count) * 100, 1)
     
     # 7. Top sources (what objects/surfaces cause the most harm)
     cursor.execute(f"""
         SELECT source_title_pred, COUNT(*) as n
-        FROM incidents
-        WHERE {category_filter} AND source_title_pred IS NOT NULL AND source_title_pred != ''
+        FROM ({matched})
+        WHERE source_title_pred != ''
         GROUP BY source_title_pred
         ORDER BY n DESC
         LIMIT 3
-    """)
-    stats['top_sources'] = [{'source': row[0], 'count': row[1]} for row in cursor.fetchall()]
+    """, params)
+    stats['top_sources'] = [{'source': source, 'count': n} for source, n in cursor]
     
     # 8. Top body parts
     cursor.execute(f"""
         SELECT part_title_pred, COUNT(*) as n
-        FROM incidents
-        WHERE {category_filter} AND part_title_pred IS NOT NULL AND part_title_pred != ''
+        FROM ({matched})
+        WHERE part_title_pred != ''
         GROUP BY part_title_pred
         ORDER BY n DESC
         LIMIT 3
-    """)
-    stats['top_body_parts'] = [{'body_part': row[0], 'count': row[1]} for row in cursor.fetchall()]
+    """, params)
+    stats['top_body_parts'] = [{'body_part': body_part, 'count': n} for body_part, n in cursor]
     
     # 9. Year breakdown
     cursor.execute(f"""
         SELECT year_filing_for, COUNT(*) as n
-        FROM incidents
-        WHERE {category_filter}
+        FROM ({matched})
         GROUP BY year_filing_for
         ORDER BY year_filing_for
-    """)
-    stats['year_breakdown'] = {str(row[0]): row[1] for row in cursor.fetchall() if row[0] is not None}
+    """, params)
+    stats['year_breakdown'] = {str(year): n for year, n in cursor if year is not None}
     
     return stats
 
 
+def _category_stats_worker(db_path: str, category: str) -> Dict:
+    """Compute one category's statistics on a dedicated connection."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory-mapped reads
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")  # GROUP BY temp b-trees in RAM
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        return compute_category_stats(conn.cursor(), category, get_category_filter(category))
+    finally:
+        conn.close()
+
+
 def build_stats_cache(db_path: Optional[str] = None) -> Dict[str, Dict]:
     """
     Build statistics cache for all hazard categories.
@@ -168,37 +208,21 @@ def build_stats_cache(db_path: Optional[str] = None) -> Dict[str, Dict]:
     if not Path(db_path).exists():
         raise FileNotFoundError(f"Database not found: {db_path}")
     
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Define all categories to compute stats for
-    categories = [
-        "Fall Hazard",
-        "Electrical Hazard",
-        "Struck By",
-        "Caught In/Between",
-        "Slip/Trip",
-        "Fire/Explosion"
-    ]
-    
-    all_stats = {}
-    
     print("Building statistics cache...")
     print("=" * 60)
     
-    for category in categories:
-        print(f"Processing {category}...", end=" ")
-        category_filter = get_category_filter(category)
-        stats = compute_category_stats(cursor, category, category_filter)
-        all_stats[category] = stats
-        print(f"{stats['total_count']:,} incidents")
-    
-    conn.close()
+    # Categories are independent, so each runs on its own thread with its
+    # own connection. SQLite allows any number of concurrent readers (the
+    # indexer leaves the database in WAL mode, where readers also never wait
+    # on a writer), and sqlite3 releases the GIL while a query runs.
+    all_stats = {}
+    with ThreadPoolExecutor(max_workers=len(STATS_CATEGORIES)) as executor:
+        results = executor.map(lambda category: _category_stats_worker(db_path, category), STATS_CATEGORIES)
+        for category, stats in zip(STATS_CATEGORIES, results):
+            all_stats[category] = stats
+            print(f"{category}: {stats['total_count']:,} incidents")
     
-    # Save to JSON cache
-    cache_path = get_cache_path()
-    with open(cache_path, 'w', encoding='utf-8') as f:
-        json.dump(all_stats, f, indent=2)
+    cache_path = _save_cache(all_stats)
     
     print("=" * 60)
     print(f"Cache saved to {cache_path}")
@@ -206,6 +230,50 @@ def build_stats_cache(db_path: Optional[str] = None) -> Dict[str, Dict]:
     return all_stats
 
 
+def _save_cache(all_stats: Dict[str, Dict]) -> Path:
+    """
+    Write the stats cache as a pickle (much faster to load than JSON; use
+    export_stats_json for a human-readable copy).
+    
+    Returns:
+        Path of the written cache file
+    """
+    cache_path = get_cache_path()
+    with open(cache_path, 'wb') as f:
+        pickle.dump(all_stats, f, protocol=5)
+    return cache_path
+
+
+def _read_cache() -> Optional[Dict[str, Dict]]:
+    """Return the cached stats, or None if the cache is missing or unreadable."""
+    cache_path = get_cache_path()
+    if not cache_path.exists():
+        return None
+    try:
+        cached = _load_cache(str(cache_path), cache_path.stat().st_mtime)
+    except Exception:
+        # A corrupted pickle can fail in many ways (UnpicklingError,
+        # ValueError, TypeError, AttributeError, ...); treat all as a miss
+        return None
+    return cached if isinstance(cached, dict) else None
+
+
+@functools.lru_cache(maxsize=1)
+def _load_cache(cache_path: str, mtime: float) -> Dict[str, Dict]:
+    """
+    Load the stats cache pickle, memoized per file path and modification
+    time so repeated lookups skip the read and decode until the cache is
+    rebuilt. The returned dict is shared between callers and must not be
+    modified.
+    """
+    # Unpickling can run arbitrary code, which is acceptable only because
+    # this file is written by build_stats_cache into the package directory,
+    # next to the database it is derived from. Do not point get_cache_path
+    # at a location other users can write to.
+    with open(cache_path, 'rb') as f:
+        return pickle.load(f)
+
+
 def get_all_stats(db_path: Optional[str] = None, use_cache: bool = True) -> Dict[str, Dict]:
     """
     Get all statistics for all categories.
@@ -216,20 +284,72 @@ def get_all_stats(db_path: Optional[str] = None, use_cache: bool = True) -> Dict
         use_cache: Whether to use cached data if available
         
     Returns:
-        Dict mapping category names to statistics
+        Dict mapping category names to statistics; a fresh copy the caller
+        may modify
     """
-    cache_path = get_cache_path()
+    if use_cache:
+        cached = _read_cache()
+        # A cache filled one category at a time by _get_stats_for may still
+        # be missing some categories
+        if cached is not None and all(category in cached for category in STATS_CATEGORIES):
+            # The loaded cache is memoized and shared, so hand out a copy
+            return copy.deepcopy(cached)
+    
+    # Cache doesn't exist, is incomplete or is invalid, build it
+    return build_stats_cache(db_path)
+
+
+def _get_stats_for(category: str, db_path: Optional[str] = None, use_cache: bool = True) -> Optional[Dict]:
+    """
+    Get the statistics for a single category.
+    Returns the cached entry if present; otherwise computes only this
+    category and merges it into the on-disk cache.
+    
+    Args:
+        category: Hazard category name
+        db_path: Optional path to SQLite database
+        use_cache: Whether to use cached data if available
+        
+    Returns:
+        Statistics dict, or None if the category is not a stats category.
+        A cached entry is shared with the memoized cache and must not be
+        modified.
+    """
+    cached = _read_cache()
     
-    if use_cache and cache_path.exists():
-        try:
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            # Cache is corrupted or unreadable, rebuild
-            pass
+    if use_cache and cached is not None and category in cached:
+        return cached[category]
     
-    # Cache doesn't exist or is invalid, build it
-    return build_stats_cache(db_path)
+    if category not in STATS_CATEGORIES:
+        return None
+    
+    if db_path is None:
+        db_path = str(get_db_path())
+    
+    if not Path(db_path).exists():
+        raise FileNotFoundError(f"Database not found: {db_path}")
+    
+    stats = _category_stats_worker(db_path, category)
+    
+    # The loaded cache is shared, so merge into a copy
+    all_stats = dict(cached) if cached is not None else {}
+    all_stats[category] = stats
+    _save_cache(all_stats)
+    
+    return stats
+
+
+def export_stats_json(output_path: str, db_path: Optional[str] = None) -> None:
+    """
+    Write all category statistics to a human-readable JSON file.
+    
+    Args:
+        output_path: Path of the JSON file to write
+        db_path: Optional path to SQLite database
+    """
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(get_all_stats(db_path), f, indent=2)
+    print(f"Statistics exported to {output_path}")
 
 
 def get_headline_stat(category: str, db_path: Optional[str] = None, use_cache: bool = True) -> str:
@@ -244,41 +364,34 @@ def get_headline_stat(category: str, db_path: Optional[str] = None, use_cache: b
     Returns:
         Formatted headline string
     """
-    all_stats = get_all_stats(db_path, use_cache)
+    stats = _get_stats_for(category, db_path, use_cache)
     
-    if category not in all_stats:
+    if stats is None:
         return f"No statistics available for {category}."
     
-    stats = all_stats[category]
+    total, fatal, pct, avg = stats['total_count'], stats['fatal_count'], stats['pct_fatal'], stats['avg_dafw']
+    sources, body_parts = stats['top_sources'], stats['top_body_parts']
     
-    if stats['total_count'] == 0:
+    if total == 0:
         return f"No {category} incidents found in dataset."
     
-    # Build the headline string
-    parts = []
-    
     # Main stats
-    parts.append(f"{stats['total_count']:,} {category} incidents recorded.")
-    parts.append(f"{stats['fatal_count']} fatalities ({stats['pct_fatal']:.1f}%).")
+    headline = f"{total:,} {category} incidents recorded. {fatal} fatalities ({pct:.1f}%)."
     
-    if stats['avg_dafw'] > 0:
-        parts.append(f"Workers averaged {stats['avg_dafw']:.0f} days away from work.")
+    if avg > 0:
+        headline += f" Workers averaged {avg:.0f} days away from work."
     
     # Top sources
-    if stats['top_sources']:
-        source_names = [s['source'] for s in stats['top_sources']]
-        if len(source_names) >= 2:
-            parts.append(f"Most common causes: {source_names[0]}, {source_names[1]}.")
-        elif len(source_names) == 1:
-            parts.append(f"Most common cause: {source_names[0]}.")
+    if len(sources) >= 2:
+        headline += f" Most common causes: {sources[0]['source']}, {sources[1]['source']}."
+    elif sources:
+        headline += f" Most common cause: {sources[0]['source']}."
     
     # Top body parts
-    if stats['top_body_parts']:
-        body_part_names = [b['body_part'] for b in stats['top_body_parts']]
-        if len(body_part_names) >= 1:
-            parts.append(f"Most affected: {body_part_names[0]}.")
+    if body_parts:
+        headline += f" Most affected: {body_parts[0]['body_part']}."
     
-    return " ".join(parts)
+    return headline
 
 
 def format_detailed_stats(category: str, db_path: Optional[str] = None, use_cache: bool = True) -> str:
@@ -293,13 +406,11 @@ def format_detailed_stats(category: str, db_path: Optional[str] = None, use_cach
     Returns:
         Formatted detailed report string
     """
-    all_stats = get_all_stats(db_path, use_cache)
+    stats = _get_stats_for(category, db_path, use_cache)
     
-    if category not in all_stats:
+    if stats is None:
         return f"No statistics available for {category}."
     
-    stats = all_stats[category]
-    
     if stats['total_count'] == 0:
         return f"No {category} incidents found in dataset."
     
@@ -332,6 +443,11 @@ def format_detailed_stats(category: str, db_path: Optional[str] = None, use_cach
 
 def main():
     """Build cache and print headline stats for each category."""
+    parser = argparse.ArgumentParser(description="Build the OSHA statistics cache")
+    parser.add_argument("--export-json", metavar="PATH",
+                        help="Also write the statistics to a human-readable JSON file")
+    args = parser.parse_args()
+    
     print("OSHA Statistics Module")
     print("=" * 60)
     print()
@@ -346,16 +462,7 @@ def main():
         print("=" * 60)
         print()
         
-        categories = [
-            "Fall Hazard",
-            "Electrical Hazard",
-            "Struck By",
-            "Caught In/Between",
-            "Slip/Trip",
-            "Fire/Explosion"
-        ]
-        
-        for category in categories:
+        for category in STATS_CATEGORIES:
             headline = get_headline_stat(category)
             print(f"{category}:")
             print(f"  {headline}")
@@ -366,6 +473,10 @@ def main():
         print("=" * 60)
         print(format_detailed_stats("Fall Hazard"))
         
+        if args.export_json:
+            print()
+            export_stats_json(args.export_json)
+        
     except FileNotFoundError as e:
         print(f"Error: {e}")
         print("Please run the indexer first to create the database.")